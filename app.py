@@ -1,14 +1,26 @@
-from flask import Flask
+from flask import Flask, send_from_directory
 from flasgger import Swagger
 from flask_cors import CORS
 from mongodb_connection_manager import MongoConnectionManager
+from cache_manager import initialize_cache
+from json_provider import OrjsonProvider
 from routes import initial_routes
 
 import os
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
-Swagger(app)
+
+if os.environ.get("ENV") == "production":
+    # Serve the spec prebuilt by tools/build_openapi.py instead of parsing every docstring
+    @app.route('/apispec_1.json')
+    def apispec():
+        return send_from_directory(app.static_folder, 'openapi.json')
+else:
+    Swagger(app)
+
+initialize_cache(app)
 MongoConnectionManager.initialize_db()
 initial_routes(app)
 
@@ -20,5 +32,6 @@ def index():
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8088))
-    app.run(debug=True , port=port, host = "0.0.0.0")
+    debug = os.environ.get("FLASK_DEBUG") == "1"
+    app.run(debug=debug , port=port, host = "0.0.0.0")
 
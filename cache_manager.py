@@ -0,0 +1,190 @@
+from dotenv import load_dotenv
+from flask_caching import Cache
+from pymongo.errors import OperationFailure
+from mongodb_connection_manager import MongoConnectionManager, ADS_COLLECTION
+import os
+import threading
+import time
+import uuid
+
+# Load environment variables
+load_dotenv()
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+CACHE_DEFAULT_TIMEOUT = int(os.getenv("CACHE_DEFAULT_TIMEOUT", "60"))
+# Invalidate cached packages from a MongoDB change stream (needs a replica set, e.g. Atlas)
+CACHE_WATCH_CHANGES = os.getenv("CACHE_WATCH_CHANGES") == "1"
+
+# Every key of the app lives under this prefix in Redis, which may be shared with other services
+CACHE_KEY_PREFIX = "ad_sdk:"
+RESUME_TOKEN_KEY = "change_stream:resume_token"
+# Part of every package generation - bumping it retires the cached responses of all packages
+GLOBAL_GENERATION_KEY = "generation"
+WATCH_RETRY_SECONDS = 5
+
+cache = Cache()
+
+
+class CacheUnavailable(Exception):
+    """
+    The cache backend (Redis) could not be reached - callers read from the database instead.
+    """
+
+
+def initialize_cache(app):
+    """
+    Attach the response cache to the Flask app.
+    Uses Redis when CACHE_REDIS_URL is set, otherwise falls back to an in-process cache.
+    :param app: Flask application
+    :return: Cache instance
+    :rtype: Cache
+    """
+    config = {"CACHE_DEFAULT_TIMEOUT": CACHE_DEFAULT_TIMEOUT}
+    if CACHE_REDIS_URL:
+        config.update({
+            "CACHE_TYPE": "RedisCache",
+            "CACHE_REDIS_URL": CACHE_REDIS_URL,
+            "CACHE_KEY_PREFIX": CACHE_KEY_PREFIX
+        })
+    else:
+        config["CACHE_TYPE"] = "SimpleCache"
+
+    cache.init_app(app, config=config)
+
+    if CACHE_WATCH_CHANGES:
+        start_change_stream_invalidation(app)
+    return cache
+
+
+def _generation_key(package_name):
+    return f"{package_name}:generation"
+
+
+def _ensure_token(key, token):
+    # A missing token (never set or evicted) is replaced by a fresh random one
+    if token is None:
+        cache.add(key, uuid.uuid4().hex, timeout=0)
+        token = cache.get(key)
+    return token
+
+
+def get_global_generation():
+    """
+    Current generation shared by every package, bumped by invalidate_all_packages().
+    :raises CacheUnavailable: when the cache backend cannot be reached
+    :rtype: str
+    """
+    try:
+        return _ensure_token(GLOBAL_GENERATION_KEY, cache.get(GLOBAL_GENERATION_KEY))
+    except Exception as e:
+        raise CacheUnavailable(str(e)) from e
+
+
+def get_package_generation(package_name):
+    """
+    Current cache generation of a package, shared by all workers through the cache.
+    A missing token (never set, evicted or cleared) is replaced by a fresh random one,
+    so a reset can never bring back a generation that older entries were keyed on.
+    :raises CacheUnavailable: when the cache backend cannot be reached
+    :rtype: str
+    """
+    key = _generation_key(package_name)
+    try:
+        # Both tokens in one round-trip
+        global_generation, generation = cache.get_many(GLOBAL_GENERATION_KEY, key)
+        global_generation = _ensure_token(GLOBAL_GENERATION_KEY, global_generation)
+        generation = _ensure_token(key, generation)
+    except Exception as e:
+        raise CacheUnavailable(str(e)) from e
+    return f"{global_generation}.{generation}"
+
+
+def invalidate_package_cache(package_name):
+    """
+    Drop every cached response of a package by moving it to a new generation.
+    Never raises: the write it follows has already succeeded.
+    :param package_name: package name
+    """
+    try:
+        cache.set(_generation_key(package_name), uuid.uuid4().hex, timeout=0)
+    except Exception as e:
+        print("⚠️ Cache error:", str(e))
+
+
+def cache_get(key):
+    """
+    cache.get() that treats an unreachable backend as a miss.
+    """
+    try:
+        return cache.get(key)
+    except Exception as e:
+        print("⚠️ Cache error:", str(e))
+        return None
+
+
+def cache_set(key, value, timeout=None):
+    """
+    cache.set() that logs, instead of raising, when the backend cannot be reached.
+    """
+    try:
+        cache.set(key, value, timeout=timeout)
+    except Exception as e:
+        print("⚠️ Cache error:", str(e))
+
+
+def invalidate_all_packages():
+    """
+    Drop the cached responses of every package by moving to a new global generation.
+    Unlike cache.clear() - a FLUSHDB on Redis - this never touches keys of other services.
+    Never raises: the write it follows has already succeeded.
+    """
+    try:
+        cache.set(GLOBAL_GENERATION_KEY, uuid.uuid4().hex, timeout=0)
+    except Exception as e:
+        print("⚠️ Cache error:", str(e))
+
+
+def _watch_ad_changes(app):
+    # invalidate (after a drop or rename of the collection) ends the stream - its token starts the next one
+    operations = ["insert", "update", "replace", "delete", "drop", "invalidate"]
+    pipeline = [{"$match": {"operationType": {"$in": operations}}}]
+
+    with app.app_context():
+        while True:
+            try:
+                ads = MongoConnectionManager.get_db()[ADS_COLLECTION]
+                resume_token = cache.get(RESUME_TOKEN_KEY)
+                # start_after, unlike resume_after, also accepts the token of an invalidate event
+                with ads.watch(pipeline, full_document='updateLookup', start_after=resume_token) as stream:
+                    for change in stream:
+                        ad = change.get("fullDocument")
+                        if ad is not None:
+                            invalidate_package_cache(ad["package_name"])
+                        else:
+                            # Deletes and drops do not carry the package - retire every package
+                            invalidate_all_packages()
+                        # Persist the position so a restarted worker resumes where it stopped
+                        cache.set(RESUME_TOKEN_KEY, stream.resume_token, timeout=0)
+                # The stream was invalidated - reopen it after the stored token, without spinning
+                time.sleep(WATCH_RETRY_SECONDS)
+            except OperationFailure as e:
+                print("⚠️ Change stream error:", str(e))
+                # The stored token may have fallen off the oplog - start from now next time
+                cache.delete(RESUME_TOKEN_KEY)
+                time.sleep(WATCH_RETRY_SECONDS)
+            except Exception as e:
+                print("⚠️ Change stream error:", str(e))
+                time.sleep(WATCH_RETRY_SECONDS)
+
+
+def start_change_stream_invalidation(app):
+    """
+    Start a daemon thread that invalidates a package's cache whenever its ads change,
+    including writes made by other workers or directly in the database.
+    :param app: Flask application
+    :return: watcher thread
+    :rtype: threading.Thread
+    """
+    watcher = threading.Thread(target=_watch_ad_changes, args=(app,), name="ad-change-stream", daemon=True)
+    watcher.start()
+    return watcher
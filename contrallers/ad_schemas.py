@@ -0,0 +1,130 @@
+from pydantic import BaseModel, TypeAdapter, field_validator, model_validator
+from pydantic_core import PydanticCustomError
+from typing import Optional
+import datetime
+import re
+
+# Validation runs in pydantic-core (compiled), in one pass over the payload
+
+VALID_CATEGORIES = frozenset(('Hotel', 'Restaurant', 'Attraction', 'Shop', 'Product'))
+INVALID_CATEGORY_ERROR = "Invalid category. Must be one of: Hotel, Restaurant, Attraction, Shop, Product"
+INVALID_DATE_ERROR = "Invalid date format. Use YYYY-MM-DD HH:MM:SS"
+DATE_ORDER_ERROR = "Beginning date must be before expiration date"
+# 'YYYY-MM-DD HH:MM:SS', or ISO-8601 with a time (optional seconds fraction and UTC offset)
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}(:?\d{2})?)?')
+
+
+def _ad_error(message):
+    # Custom error type - its message reaches the client as is
+    return PydanticCustomError('ad_error', message)
+
+
+def _check_category(category):
+    if category is not None and category not in VALID_CATEGORIES:
+        raise _ad_error(INVALID_CATEGORY_ERROR)
+    return category
+
+
+def _check_date_format(value):
+    # Runs before pydantic's lax parsing, which would also take numbers (epoch seconds) and bare dates
+    if not isinstance(value, str) or DATE_PATTERN.fullmatch(value) is None:
+        raise _ad_error(INVALID_DATE_ERROR)
+    return value
+
+
+def _to_naive_utc(value):
+    # Stored dates are naive UTC - convert timezone-aware input
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _check_date_order(beginning_date, expiration_date):
+    if beginning_date is not None and expiration_date is not None and beginning_date > expiration_date:
+        raise _ad_error(DATE_ORDER_ERROR)
+
+
+class AdCreate(BaseModel):
+    """
+    Body of POST /ad_sdk (or one element of a batch).
+    Dates accept 'YYYY-MM-DD HH:MM:SS' and ISO-8601.
+    """
+    package_name: str
+    name: str
+    description: str
+    ad_type: str
+    beginning_date: datetime.datetime
+    expiration_date: datetime.datetime
+    ad_location: str
+    ad_link: str
+    category: str
+    ad_image_link: str
+
+    _check_category = field_validator('category')(_check_category)
+    _check_date_format = field_validator('beginning_date', 'expiration_date', mode='before')(_check_date_format)
+    _to_naive_utc = field_validator('beginning_date', 'expiration_date')(_to_naive_utc)
+
+    @model_validator(mode='after')
+    def _check_dates(self):
+        _check_date_order(self.beginning_date, self.expiration_date)
+        return self
+
+
+# Body of a batch POST /ad_sdk - a JSON array of ads
+AdCreateBatch = TypeAdapter(list[AdCreate])
+
+
+class AdUpdate(BaseModel):
+    """
+    Body of PUT /ad_sdk/<package_name>/<ad_id> - every field is optional.
+    """
+    name: Optional[str] = None
+    description: Optional[str] = None
+    ad_type: Optional[str] = None
+    # Not Optional: an explicit null date is rejected
+    beginning_date: datetime.datetime = None
+    expiration_date: datetime.datetime = None
+    ad_location: Optional[str] = None
+    ad_link: Optional[str] = None
+    category: Optional[str] = None
+    ad_image_link: Optional[str] = None
+
+    _check_category = field_validator('category')(_check_category)
+    _check_date_format = field_validator('beginning_date', 'expiration_date', mode='before')(_check_date_format)
+    _to_naive_utc = field_validator('beginning_date', 'expiration_date')(_to_naive_utc)
+
+    @field_validator('ad_image_link')
+    @classmethod
+    def _check_image_link(cls, ad_image_link):
+        if ad_image_link is not None and not ad_image_link.startswith('http'):
+            raise _ad_error("Invalid ad_image_link URL")
+        return ad_image_link
+
+    @model_validator(mode='after')
+    def _check_dates(self):
+        _check_date_order(self.beginning_date, self.expiration_date)
+        return self
+
+
+def validation_error_message(error):
+    """
+    Turn a pydantic ValidationError into the API's single error message.
+    :param error: ValidationError raised by AdCreate / AdUpdate
+    :rtype: str
+    """
+    errors = error.errors()
+    missing = sorted(str(err['loc'][0]) for err in errors if err['type'] == 'missing')
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+
+    err = errors[0]
+    if err['type'] == 'ad_error':
+        return err['msg']
+    if err['type'] == 'json_invalid':
+        return "Invalid JSON body"
+    if err['type'] == 'model_type':
+        return "Invalid ad payload"
+    if err['type'].startswith('datetime'):
+        return INVALID_DATE_ERROR
+    return f"Invalid {'.'.join(str(part) for part in err['loc'])}: {err['msg']}"
+
@@ -1,295 +1,544 @@
-from flask import Blueprint, request, jsonify
-from mongodb_connection_manager import MongoConnectionManager
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from flasgger import swag_from
+from pydantic import ValidationError
+from pymongo.errors import PyMongoError
+from mongodb_connection_manager import MongoConnectionManager, ADS_COLLECTION, MONGO_MAX_TIME_MS, ad_key
+from bson import ObjectId
+from cache_manager import (
+    cache, cache_get, cache_set, get_global_generation, get_package_generation,
+    invalidate_all_packages, invalidate_package_cache, CacheUnavailable, CACHE_REDIS_URL
+)
+from stats_batcher import stats_batcher, stats_upsert, epoch_ms, fill_new_stats_details, forget_ad_details, STATS_BATCH_WRITES
+from json_provider import dumps_bytes
+from contrallers.ad_schemas import AdCreate, AdCreateBatch, AdUpdate, DATE_ORDER_ERROR, validation_error_message
+from concurrent.futures import ThreadPoolExecutor
+import bisect
 import datetime
-import uuid
+import functools
+import hashlib
+import itertools
+import os
+import time
 
 ad_sdk_blueprint = Blueprint('ad_sdk', __name__)
 
+# Fields returned by the ad listings unless the client asks for more with ?fields=
+ACTIVE_AD_FIELDS = (
+    'name', 'ad_type', 'category', 'ad_link', 'ad_image_link',
+    'ad_location', 'beginning_date', 'expiration_date'
+)
+# Fields a client may pick with ?fields= - anything else never reaches the find() projection
+PROJECTABLE_FIELDS = frozenset(AdCreate.model_fields) | {'_id', 'created_at', 'updated_at'}
+INVALID_FIELDS_ERROR = "Invalid fields parameter. Use 'all' or a comma separated list of ad fields"
+# Documents per cursor batch (and per streamed chunk) - ads are a few KB at most, so a large
+# batch keeps most listings to a single round-trip instead of the driver's first batch of 101
+AD_CURSOR_BATCH_SIZE = int(os.getenv("AD_CURSOR_BATCH_SIZE", "1000"))
+# Without Redis the package generation is per worker, so writes made by other workers (or
+# directly in the database) only show up once these copies expire: ads memoized in worker
+# memory live at most AD_MEMO_TTL seconds, and so does the in-process active-ads list
+AD_MEMO_TTL = 30
+# How long a package's materialized active-ads list may live without a write (writes replace it)
+ACTIVE_ADS_TIMEOUT = 3600 if CACHE_REDIS_URL else AD_MEMO_TTL
+# The stats summary is not invalidated by clicks / views - it may lag this many seconds
+SUMMARY_CACHE_TIMEOUT = 60
+
+# Insert new ads in the background and answer 202 (needs a long-running worker)
+ASYNC_AD_WRITES = os.getenv("ASYNC_AD_WRITES") == "1"
+AD_WRITER_THREADS = int(os.getenv("AD_WRITER_THREADS", "8"))
+_ad_writer = ThreadPoolExecutor(max_workers=AD_WRITER_THREADS, thread_name_prefix="ad-writer") if ASYNC_AD_WRITES else None
+
+# Pre-serialized bodies of the most common error responses
+DB_ERROR_BODY = b'{"error":"Database connection error"}'
+AD_NOT_FOUND_BODY = b'{"error":"Ad not found"}'
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _json_response(payload, status=200):
+    """
+    Serialize Mongo documents straight into a JSON response.
+    :param payload: document or list of documents
+    :param status: HTTP status code
+    :rtype: tuple
+    """
+    return Response(dumps_bytes(payload), mimetype='application/json'), status
+
+
+def _json_array_chunks(cursor):
+    """
+    Serialize a cursor (or any iterable of documents) as a JSON array, one cursor batch per chunk,
+    so no more than a batch of documents is held in memory.
+    :rtype: generator of bytes
+    """
+    yield b'['
+    separator = b''
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) == AD_CURSOR_BATCH_SIZE:
+            yield separator + _array_items(batch)
+            separator, batch = b',', []
+    if batch:
+        yield separator + _array_items(batch)
+    yield b']'
+
+
+def _array_items(docs):
+    # The items of a serialized list, without the surrounding brackets
+    body = dumps_bytes(docs)
+    if isinstance(body, str):
+        body = body.encode()
+    return body[1:-1]
+
+
+def _db_error():
+    # A fresh Response per call - hooks such as CORS add headers to the returned object
+    return Response(DB_ERROR_BODY, status=500, mimetype='application/json')
+
+
+def _ad_not_found():
+    return Response(AD_NOT_FOUND_BODY, status=404, mimetype='application/json')
+
+
+def _fields_projection(default_fields):
+    """
+    Build the find() projection from the ?fields= query argument.
+    'all' (or ?full=1) returns whole documents, a comma separated list picks those fields,
+    no argument (or no field names, e.g. ?fields=,) falls back to default_fields (None for whole documents).
+    :raises ValueError: when a requested field is not an ad field
+    :rtype: dict or None
+    """
+    fields = request.args.get('fields')
+    if fields == 'all' or request.args.get('full') == '1':
+        return None
+    # An empty projection would mean whole documents to find() but only _id to _active_ads_now
+    projection = {field.strip(): 1 for field in (fields or '').split(',') if field.strip()}
+    if projection:
+        if not PROJECTABLE_FIELDS.issuperset(projection):
+            raise ValueError(fields)
+        return projection
+    return dict.fromkeys(default_fields, 1) if default_fields is not None else None
+
+
+def _parse_query_date(value):
+    """
+    Parse a 'YYYY-MM-DD' query argument by slicing - strptime goes through the
+    locale-aware _strptime machinery on every call.
+    :raises ValueError: when the value is not a valid date in that format
+    :rtype: datetime.datetime
+    """
+    if len(value) != 10 or value[4] != '-' or value[7] != '-' or not (value[:4] + value[5:7] + value[8:]).isdigit():
+        raise ValueError(value)
+    return datetime.datetime(int(value[:4]), int(value[5:7]), int(value[8:]))
+
+
+def _package_etag(db, package_name):
+    """
+    ETag of all the ads of a package, derived from its most recent update and the requested fields.
+    Costs one indexed find_one instead of reading every ad.
+    :rtype: str
+    """
+    latest = db[ADS_COLLECTION].find_one(
+        {"package_name": package_name}, projection={"updated_at": 1}, sort=[("updated_at", -1)],
+        max_time_ms=MONGO_MAX_TIME_MS
+    )
+    version = str(latest.get("updated_at")) if latest else "empty"
+    version += f"|{request.args.get('fields', '')}|{request.args.get('full', '')}"
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+#---------------- Response cache helpers -------------------------#
+
+def _package_cache_key(package_name, **kwargs):
+    # The package generation is part of the key, so bumping it drops every cached GET of the package
+    generation = get_package_generation(package_name)
+    args = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    return f"{package_name}:{generation}:{request.path}?{args}"
+
+
+def _summary_cache_key():
+    # Retired along with every package by invalidate_all_packages()
+    return f"stats:summary:{get_global_generation()}"
+
+
+def _cache_ok(rv):
+    # Only cache successful responses - streamed ones store themselves once complete
+    return isinstance(rv, tuple) and rv[1] == 200 and not getattr(rv[0], 'is_streamed', False)
+
+
+def _stream_and_cache(chunks, cache_key, headers):
+    """
+    Pass a streamed body through and, once it is complete, store it under the
+    response cache key so the next request for it does not reach the database.
+    :param cache_key: None when the cache is unavailable - the body is only passed through
+    """
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    if cache_key is not None:
+        cache_set(cache_key, (b''.join(body), 200, headers))
+
+
+@functools.lru_cache(maxsize=10000)
+def _fetch_ad(package_name, ad_id, generation, ttl_bucket):
+    """
+    Serialized ad by ID, memoized in the worker's memory.
+    The package generation is part of the key, so a write seen by this worker's cache makes
+    old entries unreachable; ttl_bucket changes every AD_MEMO_TTL seconds and retires the rest.
+    :return: JSON body, or None when the ad does not exist
+    """
+    ad = MongoConnectionManager.get_read_db()[ADS_COLLECTION].find_one(
+        {"_id": ad_key(ad_id), "package_name": package_name}, max_time_ms=MONGO_MAX_TIME_MS
+    )
+    return dumps_bytes(ad) if ad else None
+
+
+def _uses_active_ads_index():
+    # "Active now" queries are answered from the materialized list instead of the response cache
+    return 'date' not in request.args and request.args.get('all') != 'true'
+
+
+def _memo_window(now):
+    # Start of the AD_MEMO_TTL-second window holding now - the time bucket of the active-ads memo
+    return now - (now - EPOCH) % datetime.timedelta(seconds=AD_MEMO_TTL)
+
+
+def _load_active_ad_candidates(package_name, since):
+    """
+    Every ad of the package that had not expired at since, sorted by expiration_date.
+    :param since: naive UTC datetime, at most the request time
+    :return: (expiration dates, ads) - parallel lists
+    :rtype: tuple
+    """
+    ads = list(
+        MongoConnectionManager.get_read_db()[ADS_COLLECTION].find({
+            "package_name": package_name,
+            "expiration_date": {"$gte": since}
+        })
+        .sort("expiration_date", 1)
+        .max_time_ms(MONGO_MAX_TIME_MS)
+        .batch_size(AD_CURSOR_BATCH_SIZE)
+    )
+    return [ad['expiration_date'] for ad in ads], ads
+
+
+@functools.lru_cache(maxsize=256)
+def _active_ad_candidates(package_name, generation, window):
+    """
+    _load_active_ad_candidates, materialized in the shared cache per package generation,
+    so any write replaces it, and memoized in the worker's memory for the AD_MEMO_TTL window
+    so repeat requests skip fetching and unpickling the list.
+    :param window: _memo_window() of the request time
+    :return: (expiration dates, ads) - parallel lists, shared between requests (read only)
+    :rtype: tuple
+    """
+    key = f"{package_name}:{generation}:active"
+    candidates = cache_get(key)
+    if candidates is None:
+        candidates = _load_active_ad_candidates(package_name, window)
+        cache_set(key, candidates, timeout=ACTIVE_ADS_TIMEOUT)
+    return candidates
+
+
+def _active_ads_now(package_name, projection):
+    """
+    Ads active right now, filtered by the location / category query arguments.
+    :param projection: fields to keep, from _fields_projection (None for whole ads)
+    :rtype: list
+    """
+    now = datetime.datetime.utcnow()
+    try:
+        expirations, ads = _active_ad_candidates(package_name, get_package_generation(package_name), _memo_window(now))
+    except CacheUnavailable:
+        expirations, ads = _load_active_ad_candidates(package_name, now)
+    location = request.args.get('location')
+    category = request.args.get('category')
+    # Built once per request rather than once per ad
+    fields = ('_id', *projection) if projection is not None else None
+
+    active = []
+    # Skip the ads that expired since the list was built
+    for ad in ads[bisect.bisect_left(expirations, now):]:
+        if ad['beginning_date'] > now:
+            continue
+        if location is not None and ad.get('ad_location') != location:
+            continue
+        if category is not None and ad.get('category') != category:
+            continue
+        if fields is not None:
+            ad = {field: ad[field] for field in fields if field in ad}
+        active.append(ad)
+    return active
+
+
+@ad_sdk_blueprint.after_request
+def _add_conditional_headers(response):
+    # GETs carry an ETag, so polling clients can revalidate and get an empty 304 back
+    if request.method == 'GET' and response.status_code == 200:
+        if 'ETag' not in response.headers:
+            response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+@ad_sdk_blueprint.errorhandler(PyMongoError)
+def _handle_db_error(error):
+    # The pooled client outlives an outage, so an unreachable cluster surfaces here
+    # (server selection timeout, lost connection) rather than as get_db() returning None
+    print("⚠️ Database error:", str(error))
+    return _db_error()
+
+
 # 1. Create a new ad
 @ad_sdk_blueprint.route('/ad_sdk', methods=['POST'])
+@swag_from('specs/create_ad.yaml')
 def create_ad():
-    """
-    Create a new ad
-    ---
-    parameters:
-      - name: ad
-        in: body
-        required: true
-        schema:
-          type: object
-          required:
-            - package_name
-            - name
-            - description
-            - ad_type
-            - beginning_date
-            - expiration_date
-            - ad_location
-            - ad_link
-            - category
-            - ad_image_link
-          
-          properties:
-            package_name:
-              type: string
-              description: "App package name the ad is associated with"
-            name:
-              type: string
-              description: "Name of the ad"
-            description:
-              type: string
-              description: "Description of the ad"
-            ad_type:
-              type: string
-              description: "Type of the ad (e.g., image, video)"
-            beginning_date:
-              type: string
-              description: "Start date of the ad (format: YYYY-MM-DD HH:MM:SS)"
-            expiration_date:
-              type: string
-              description: "End date of the ad (format: YYYY-MM-DD HH:MM:SS)"
-            ad_location:
-              type: string
-              description: "Location to target the ad"
-            ad_link:
-              type: string
-              description: "Link to the ad content"
-            category:
-              type: string
-              enum: ["Hotel", "Restaurant", "Attraction", "Shop", "Product"]
-              description: "Hotel / Restaurant  / Attraction / Shop / Product"
-            ad_image_link:
-              type: string
-              description: "Link to the ad url"
-    responses:
-      201:
-        description: Ad created successfully
-      400:
-        description: Bad request, missing fields or invalid date format
-      500:
-        description: Internal server error
-    """
-    data = request.get_json()
+    """Create a new ad (or several ads when the body is a JSON array of ads)"""
+    body = request.get_data()
 
     # Start by checking DB connection
     db = MongoConnectionManager.get_db()
     if db is None:
-        return jsonify({"error": "Database connection error"}), 500
+        return _db_error()
 
-    # Required fields check
-    required_fields = [
-        'package_name', 'name', 'description', 'ad_type',
-        'beginning_date', 'expiration_date', 'ad_location', 'ad_link','category', 'ad_image_link'
-    ]
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields"}), 400
+    # One timestamp per request, shared by every ad it creates
+    now = datetime.datetime.utcnow()
 
-    # Date parsing
-    try:
-        begin = datetime.datetime.strptime(data['beginning_date'], '%Y-%m-%d %H:%M:%S')
-        expire = datetime.datetime.strptime(data['expiration_date'], '%Y-%m-%d %H:%M:%S')
-    except ValueError:
-        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD HH:MM:SS"}), 400
-
-    if begin > expire:
-        return jsonify({"error": "Beginning date must be before expiration date"}), 400
-    
-    valid_categories = ['Hotel', 'Restaurant', 'Attraction', 'Shop' , 'Product']
-    if data['category'] not in valid_categories:
-        return jsonify({"error": "Invalid category. Must be one of: Hotel, Restaurant, Attraction, Shop, Product"}), 400
-
-
-    # Create the ad item
-    ad_item = {
-        "_id": str(uuid.uuid4()),
-        "package_name": data['package_name'],
-        "category": data['category'],
-        "name": data['name'],
-        "description": data['description'],
-        "ad_type": data['ad_type'],
-        "beginning_date": begin,
-        "expiration_date": expire,
-        "ad_location": data['ad_location'],
-        "ad_link": data['ad_link'],
-        "created_at": datetime.datetime.now(),
-        "updated_at": datetime.datetime.now(),
-        "ad_image_link": data['ad_image_link']
-    }
+    # Batch create - one insert_many instead of one request per ad
+    if body.lstrip()[:1] == b'[':
+        try:
+            # The whole array is decoded and validated in one pydantic-core pass
+            ad_items = [_ad_document(ad, now) for ad in AdCreateBatch.validate_json(body)]
+        except ValidationError:
+            return jsonify({"error": _batch_error_message()}), 400
+
+        ids = [str(ad_item["_id"]) for ad_item in ad_items]
+        if ASYNC_AD_WRITES:
+            _submit_ad_write(db, ad_items)
+            return jsonify({"message": "Ads accepted", "_ids": ids}), 202
+        try:
+            _insert_ads(db, ad_items)
+            return jsonify({"message": "Ads created successfully", "_ids": ids}), 201
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
 
-    # Insert into MongoDB in the correct collection
+    ad_item, error = _build_ad_item(body, now)
+    if error:
+        return jsonify({"error": error}), 400
+
+    if ASYNC_AD_WRITES:
+        _submit_ad_write(db, [ad_item])
+        return jsonify({"message": "Ad accepted", "_id": str(ad_item["_id"])}), 202
+
+    # Insert into MongoDB - the package is a field of the ad
     try:
-        db[data['package_name']].insert_one(ad_item)
-        return jsonify({"message": "Ad created successfully", "_id": ad_item["_id"]}), 201
+        _insert_ads(db, [ad_item])
+        return jsonify({"message": "Ad created successfully", "_id": str(ad_item["_id"])}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _insert_ads(db, ad_items):
+    """
+    Insert new ads and drop the cached responses of their packages.
+    :param ad_items: documents built by _build_ad_item
+    """
+    MongoConnectionManager.ensure_indexes_once(db, ADS_COLLECTION)
+    if len(ad_items) == 1:
+        db[ADS_COLLECTION].insert_one(ad_items[0])
+    elif ad_items:
+        db[ADS_COLLECTION].insert_many(ad_items, ordered=False)
+    for package_name in {ad_item['package_name'] for ad_item in ad_items}:
+        invalidate_package_cache(package_name)
+
+
+def _submit_ad_write(db, ad_items):
+    # The cache lives on the app, so the background write needs its own app context
+    app = current_app._get_current_object()
+
+    def write():
+        with app.app_context():
+            try:
+                _insert_ads(db, ad_items)
+            except Exception as e:
+                print("⚠️ ERROR:", str(e))
+
+    _ad_writer.submit(write)
+
+
+def _build_ad_item(data, now):
+    """
+    Validate a create-ad payload and build the document to insert.
+    :param data: ad fields from the request body, or the raw JSON body itself
+    :param now: request timestamp, used for both created_at and updated_at
+    :return: (ad_item, None) when valid, (None, error message) otherwise
+    :rtype: tuple
+    """
+    try:
+        if isinstance(data, bytes):
+            # Decoded and validated in a single pydantic-core pass - no intermediate dict
+            ad = AdCreate.model_validate_json(data)
+        else:
+            ad = AdCreate.model_validate(data)
+    except ValidationError as e:
+        return None, validation_error_message(e)
+    return _ad_document(ad, now), None
+
+
+def _ad_document(ad, now):
+    # The document stored for a validated AdCreate - a 12-byte ObjectId keeps the _id index
+    # about a third of the size of UUID strings, and is known before the insert is acknowledged
+    return {
+        "_id": ObjectId(),
+        **ad.model_dump(),
+        "created_at": now,
+        "updated_at": now
+    }
+
+
+def _batch_error_message():
+    # Error path only: validate the ads one by one to name the first invalid one
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return "Invalid JSON body"
+    for index, ad_data in enumerate(data):
+        _, error = _build_ad_item(ad_data, None)
+        if error:
+            return f"Ad {index}: {error}"
+    return "Invalid ad payload"
+
+
 # 2. Get all ads for package name
 @ad_sdk_blueprint.route('/ad_sdk/<package_name>/all', methods=['GET'])
+@cache.cached(make_cache_key=_package_cache_key, response_filter=_cache_ok)
+@swag_from('specs/get_ads.yaml')
 def get_ads(package_name):
-    """
-    Get all ads for a package
-    ---
-    parameters:
-      - name: package_name
-        in: path
-        required: true
-        type: string
-    responses:
-      200: {description: List of ads}
-    """
-    db = MongoConnectionManager.get_db()
+    """Get all ads for a package"""
+    db = MongoConnectionManager.get_read_db()
     if db is None:
-        return jsonify({"error": "Database connection error"}), 500
+        return _db_error()
 
-    ads = list(db[package_name].find())
-    for ad in ads:
-        ad['_id'] = str(ad['_id'])
-    return jsonify(ads), 200
+    # Whole ads by default (the dashboard edits them) - pollers can trim with ?fields=
+    try:
+        projection = _fields_projection(None)
+    except ValueError:
+        return jsonify({"error": INVALID_FIELDS_ERROR}), 400
+
+    # Polling clients that already hold the latest list get an empty 304
+    etag = _package_etag(db, package_name)
+    if etag in request.if_none_match:
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    # No maxTimeMS here: it spans the whole cursor, and would cut a large package off mid-response
+    cursor = db[ADS_COLLECTION].find({"package_name": package_name}, projection).batch_size(AD_CURSOR_BATCH_SIZE)
+    # Run the query (first batch) before the 200 goes out, so a failing find still gets a JSON error
+    first = next(cursor, None)
+    docs = itertools.chain((first,), cursor) if first is not None else ()
+
+    # Streamed batch by batch instead of building the whole list first
+    headers = {"Content-Type": "application/json", "ETag": f'"{etag}"'}
+    try:
+        cache_key = _package_cache_key(package_name)
+    except CacheUnavailable:
+        cache_key = None
+    body = _stream_and_cache(_json_array_chunks(docs), cache_key, headers)
+    return Response(stream_with_context(body), headers=headers), 200
 
 
 # 3. Get ad by ID
 @ad_sdk_blueprint.route('/ad_sdk/<package_name>/<ad_id>', methods=['GET'])
+@swag_from('specs/get_ad_by_id.yaml')
 def get_ad_by_id(package_name, ad_id):
-    """
-    Get ad by ID
-    ---
-    parameters:
-      - name: package_name
-        in: path
-        required: true
-      - name: ad_id
-        in: path
-        required: true
-    responses:
-      200: {description: Ad found}
-      404: {description: Not found}
-    """
-    db = MongoConnectionManager.get_db()
+    """Get ad by ID"""
+    db = MongoConnectionManager.get_read_db()
     if db is None:
-        return jsonify({"error": "Database connection error"}), 500
+        return _db_error()
 
-    ad = db[package_name].find_one({"_id": ad_id})
-    if ad:
-        ad['_id'] = str(ad['_id'])
-        return jsonify(ad), 200
-    return jsonify({"error": "Ad not found"}), 404
+    try:
+        generation = get_package_generation(package_name)
+        body = _fetch_ad(package_name, ad_id, generation, int(time.monotonic() // AD_MEMO_TTL))
+    except CacheUnavailable:
+        # Not memoized: without the generation a later write could not retire the entry
+        body = _fetch_ad.__wrapped__(package_name, ad_id, None, None)
+    if body:
+        return Response(body, mimetype='application/json'), 200
+    return _ad_not_found()
 
 
 # 4. Update ad by ID
 @ad_sdk_blueprint.route('/ad_sdk/<package_name>/<ad_id>', methods=['PUT'])
+@swag_from('specs/update_ad.yaml')
 def update_ad(package_name, ad_id):
-    """
-    Update ad details by ID and package name
-    ---
-    parameters:
-      - name: package_name
-        in: path
-        required: true
-      - name: ad_id
-        in: path
-        required: true
-      - name: ad
-        in: body
-        required: true
-        schema:
-          id: Ad
-          properties:
-            name: {type: string}
-            description: {type: string}
-            ad_type: {type: string}
-            beginning_date: {type: string}
-            expiration_date: {type: string}
-            ad_location: {type: string}
-            ad_link: {type: string}
-            category: {type: string}
-            ad_image_link: {type: string}
-    responses:
-      200: {description: Ad updated}
-      404: {description: Ad not found}
-    """
+    """Update ad details by ID and package name"""
     db = MongoConnectionManager.get_db()
     if db is None:
-        return jsonify({"error": "Database connection error"}), 500
-
-    data = request.get_json()
-    update_fields = {}
-
-    for field in ['name', 'description', 'ad_type', 'ad_location', 'ad_link', 'category', 'ad_image_link']:
-        if field in data:
-            update_fields[field] = data[field]
+        return _db_error()
 
     try:
-        if 'beginning_date' in data:
-            update_fields['beginning_date'] = datetime.datetime.strptime(data['beginning_date'], '%Y-%m-%d %H:%M:%S')
-        if 'expiration_date' in data:
-            update_fields['expiration_date'] = datetime.datetime.strptime(data['expiration_date'], '%Y-%m-%d %H:%M:%S')
-    except ValueError:
-        return jsonify({"error": "Invalid date format"}), 400
-
-    if 'beginning_date' in update_fields and 'expiration_date' in update_fields:
-        if update_fields['beginning_date'] > update_fields['expiration_date']:
-            return jsonify({"error": "Beginning date must be before expiration date"}), 400
-        
-    if 'ad_image_link' in update_fields and not update_fields['ad_image_link'].startswith('http'):
-        return jsonify({"error": "Invalid ad_image_link URL"}), 400
-    
-    valid_categories = ['Hotel', 'Restaurant', 'Attraction', 'Shop', 'Product']
-    if 'category' in data and data['category'] not in valid_categories:
-        return jsonify({
-        "error": f"Invalid category. Must be one of: {', '.join(valid_categories)}" }), 400
-    
-    update_fields['updated_at'] = datetime.datetime.now()
-    result = db[package_name].update_one({"_id": ad_id}, {"$set": update_fields})
+        update_fields = AdUpdate.model_validate_json(request.get_data()).model_dump(exclude_unset=True)
+    except ValidationError as e:
+        return jsonify({"error": validation_error_message(e)}), 400
 
+    # A single new date is checked against the stored one inside the update filter - no prior read
+    ad_filter = {"_id": ad_key(ad_id), "package_name": package_name}
+    query = dict(ad_filter)
+    if 'beginning_date' in update_fields and 'expiration_date' not in update_fields:
+        query['expiration_date'] = {"$gte": update_fields['beginning_date']}
+    elif 'expiration_date' in update_fields and 'beginning_date' not in update_fields:
+        query['beginning_date'] = {"$lte": update_fields['expiration_date']}
+
+    update_fields['updated_at'] = datetime.datetime.utcnow()
+    result = db[ADS_COLLECTION].update_one(query, {"$set": update_fields})
 
     if result.matched_count == 0:
-        return jsonify({"error": "Ad not found"}), 404
-    
-  
+        # Only on failure: tell a date-order conflict apart from a missing ad
+        if len(query) > len(ad_filter) and db[ADS_COLLECTION].find_one(ad_filter, {"_id": 1}) is not None:
+            return jsonify({"error": DATE_ORDER_ERROR}), 400
+        return _ad_not_found()
+
+    # Stats keep a copy of the ad name
+    if 'name' in update_fields:
+        db["AdClickStats"].update_many({"ad_id": ad_id}, {"$set": {"ad_name": update_fields['name']}})
+    if 'name' in update_fields or 'category' in update_fields:
+        forget_ad_details()
+
+    invalidate_package_cache(package_name)
     return jsonify({"message": "Ad updated successfully", "_id": ad_id}), 200
 
 
 @ad_sdk_blueprint.route('/ad_sdk/<package_name>', methods=['GET'])
+@cache.cached(make_cache_key=_package_cache_key, response_filter=_cache_ok, unless=_uses_active_ads_index)
+@swag_from('specs/get_ads_by_date_or_location_or_category.yaml')
 def get_ads_by_date_or_location_or_category(package_name):
-    """
-    Get active ads by date, location, or category
-    ---
-    parameters:
-      - name: package_name
-        in: path
-        required: true
-      - name: date
-        in: query
-        required: false
-        type: string
-      - name: location
-        in: query
-        required: false
-        type: string
-      - name: category
-        in: query
-        required: false
-        type: string
-    responses:
-      200: {description: List of filtered ads}
-    """
-    db = MongoConnectionManager.get_db()
+    """Get active ads by date, location, or category"""
+    db = MongoConnectionManager.get_read_db()
     if db is None:
-        return jsonify({"error": "Database connection error"}), 500
+        return _db_error()
+
+    try:
+        projection = _fields_projection(ACTIVE_AD_FIELDS)
+    except ValueError:
+        return jsonify({"error": INVALID_FIELDS_ERROR}), 400
+
+    if _uses_active_ads_index():
+        return _json_response(_active_ads_now(package_name, projection))
 
-    query = {}
-    now = datetime.datetime.now()
-    filter_date = now
+    query = {"package_name": package_name}
+    filter_date = None
 
     if 'date' in request.args:
         try:
-            filter_date = datetime.datetime.strptime(request.args.get('date'), '%Y-%m-%d')
+            filter_date = _parse_query_date(request.args.get('date'))
         except ValueError:
             return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
 
-    query["beginning_date"] = {"$lte": filter_date}
-    query["expiration_date"] = {"$gte": filter_date}
+    # ?all=true skips the active window, the other filters still apply.
+    # Without it a date was given - "active now" is answered by _active_ads_now above
+    if request.args.get('all') != 'true':
+        # Ads running at any time that day - bounded on both sides of the indexed beginning_date
+        query["beginning_date"] = {"$lt": filter_date + datetime.timedelta(days=1)}
+        query["expiration_date"] = {"$gte": filter_date}
 
     if 'location' in request.args:
         query["ad_location"] = request.args.get('location')
@@ -297,70 +546,70 @@ def get_ads_by_date_or_location_or_category(package_name):
     if 'category' in request.args:
         query["category"] = request.args.get('category')
 
-    ads = list(db[package_name].find(query))
-    for ad in ads:
-        ad['_id'] = str(ad['_id'])
-    return jsonify(ads), 200
+    ads = list(db[ADS_COLLECTION].find(query, projection).max_time_ms(MONGO_MAX_TIME_MS).batch_size(AD_CURSOR_BATCH_SIZE))
+    return _json_response(ads)
 
 
 
 # 6. Delete all ads
 @ad_sdk_blueprint.route('/ad_sdk', methods=['DELETE'])
+@swag_from('specs/delete_all_ads.yaml')
 def delete_all_ads():
-    """
-    Delete all ads from package - Ads
-    ---
-    responses:
-      200: {description: All ads deleted}
-    """
+    """Delete all ads from every package"""
     db = MongoConnectionManager.get_db()
     if db is None:
-        return jsonify({"error": "Database connection error"}), 500
+        return _db_error()
 
-    for name in db.list_collection_names():
-        db['Ads'].delete_many({})
+    # One drop of the single ads collection - a metadata operation, unlike delete_many
+    # which removes document by document
+    try:
+        db.drop_collection(ADS_COLLECTION)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    invalidate_all_packages()
+    _fetch_ad.cache_clear()
+    _active_ad_candidates.cache_clear()
+    forget_ad_details()
+
+    try:
+        MongoConnectionManager.ensure_ad_indexes(db)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
     return jsonify({"message": "All ads deleted successfully"}), 200
 
 
 #---------------- Application Information -------------------------#
 
-#1. update clicks per ad in a spesific app
-@ad_sdk_blueprint.route('/ad_sdk/<ad_id>/click', methods=['POST'])
-def record_ad_click(ad_id):  
+def _bump(counter, ad_id, category, label):
+    """
+    Count one event of an ad in the app given by ?package_name=.
+    :param counter: stats field to increment (clicks_count, views_count, completed_views_count)
+    :param category: category reported by a view (stored on a new stats document) or None
+    :param label: event name used in the response message
+    """
     package_name = request.args.get("package_name")
     if not package_name:
         return jsonify({"error": "Missing package_name parameter"}), 400
-    
+
+    if STATS_BATCH_WRITES:
+        stats_batcher.add(ad_id, package_name, counter, category=category)
+        return jsonify({"message": f"{label} accepted"}), 202
+
     db = MongoConnectionManager.get_db()
-    stats_collection = db["AdClickStats"]
-    ads_collection = db["Ads"]
-    now = datetime.datetime.utcnow()
+    now = epoch_ms()
+    last_clicked_at = now if counter == "clicks_count" else None
 
     try:
-        ad_doc = ads_collection.find_one({"_id": ad_id})
-        ad_name = ad_doc["name"] if ad_doc and "name" in ad_doc else "Unknown Ad"
-        category = ad_doc["category"] if ad_doc and "category" in ad_doc else "Unknown"
-
-        result = stats_collection.update_one(
-            {"ad_id": ad_id, "package_name": package_name},
-            {
-                "$inc": {"clicks_count": 1},
-                "$setOnInsert": {
-                    "views_count": 0,
-                    "completed_views_count": 0,
-                    "created_at": now,
-                    "category": category
-                },
-                "$set": {
-                    "last_clicked_at": now,
-                    "ad_name": ad_name,
-                }
-            },
-            upsert=True
-        )
+        MongoConnectionManager.ensure_indexes_once(db, "AdClickStats")
+        stats_filter, update = stats_upsert(ad_id, package_name, category, {counter: 1}, now, last_clicked_at)
+        result = db["AdClickStats"].update_one(stats_filter, update, upsert=True)
+        if result.upserted_id is not None:
+            # A view's category comes from the app reporting it
+            fill_new_stats_details(db, result.upserted_id, ad_id, with_category=category is None)
 
         return jsonify({
-            "message": "Click recorded successfully",
+            "message": f"{label} recorded successfully",
             "upserted": result.upserted_id is not None
         }), 200
 
@@ -368,167 +617,41 @@ def record_ad_click(ad_id):
         print("⚠️ ERROR:", str(e))
         return jsonify({"error": str(e)}), 500
 
+
+#1. update clicks per ad in a spesific app
+@ad_sdk_blueprint.route('/ad_sdk/<ad_id>/click', methods=['POST'])
+def record_ad_click(ad_id):
+    return _bump("clicks_count", ad_id, None, "Click")
+
 #2 . Update views count 
 @ad_sdk_blueprint.route('/ad_sdk/<ad_id>/view', methods=['POST'])
+@swag_from('specs/record_ad_view.yaml')
 def record_ad_view(ad_id):
-    """
-    Record a view for a specific ad in a specific app
-    ---
-    parameters:
-      - name: ad_id
-        in: path
-        type: string
-        required: true
-        description: The ID of the ad
-      - name: package_name
-        in: query
-        type: string
-        required: true
-        description: The app's package name reporting the view
-      - name: category
-        in: query
-        type: string
-        required: true
-        description: The ad's category (Hotel, Restaurant, etc.)
-    responses:
-      200:
-        description: View recorded successfully
-      400:
-        description: Missing package_name parameter
-      500:
-        description: Internal server error
-    """
-
-    package_name = request.args.get("package_name")
-    if not package_name:
-        return jsonify({"error": "Missing package_name parameter"}), 400
-    
+    """Record a view for a specific ad in a specific app"""
     category = request.args.get("category")
-    if not category:
+    if request.args.get("package_name") and not category:
         return jsonify({"error": "Missing category parameter"}), 400
-    
-    print("===== RECORD VIEW START =====")
-    print("ad_id:", ad_id)
-    print("package_name:", package_name)
-    print("category:", category)
-    
-    db = MongoConnectionManager.get_db()
-    stats_collection = db["AdClickStats"]
-    ads_collection = db["Ads"]
 
-    now = datetime.datetime.utcnow()
-
-    try:
-        ad_doc = ads_collection.find_one({"_id": ad_id})
-        ad_name = ad_doc["name"] if ad_doc and "name" in ad_doc else "Unknown Ad"
-
-        result = stats_collection.update_one(
-            {"ad_id": ad_id, "package_name": package_name, "category": category},
-            {
-                "$inc": {"views_count": 1},
-                "$setOnInsert": {
-                    "clicks_count": 0,
-                    "completed_views_count": 0,
-                    "created_at": now,
-                    "category": category
- 
-                },
-                "$set": {
-                "ad_name": ad_name,
-
-                }
-
-            },
-            upsert=True
-        )
-
-        return jsonify({
-            "message": "View recorded successfully",
-            "upserted": result.upserted_id is not None
-        }), 200
-
-    except Exception as e:
-        print("⚠️ ERROR:", str(e))
-        return jsonify({"error": str(e)}), 500
+    # No-op at the default log level - stdout writes are not free under load
+    current_app.logger.debug("Record view: ad_id=%s package_name=%s category=%s",
+                             ad_id, request.args.get("package_name"), category)
+    return _bump("views_count", ad_id, category, "View")
 
 #3 Update - for ads videos - count of completed views
 @ad_sdk_blueprint.route('/ad_sdk/<ad_id>/view/completed', methods=['POST'])
+@swag_from('specs/record_completed_view.yaml')
 def record_completed_view(ad_id):
-    """
-    Record a completed view for a video ad in a specific app
-    ---
-    parameters:
-      - name: ad_id
-        in: path
-        type: string
-        required: true
-        description: The ID of the ad
-      - name: package_name
-        in: query
-        type: string
-        required: true
-        description: The app's package name reporting the completed view
-      - name: category
-        in: query
-        type: string
-        required: true
-        description: The ad's category (Hotel, Restaurant, etc.)
-    responses:
-      200:
-        description: Completed view recorded successfully
-      400:
-        description: Missing package_name parameter
-      500:
-        description: Internal server error
-    """
-    package_name = request.args.get("package_name")
-    if not package_name:
-        return jsonify({"error": "Missing package_name parameter"}), 400
-
-    db = MongoConnectionManager.get_db()
-    stats_collection = db["AdClickStats"]
-    ads_collection = db["Ads"]
-
-    now = datetime.datetime.utcnow()
-
-    try:
-        ad_doc = ads_collection.find_one({"_id": ad_id})
-        ad_name = ad_doc["name"] if ad_doc and "name" in ad_doc else "Unknown Ad"
-        category = ad_doc["category"] if ad_doc and "category" in ad_doc else "Unknown"
-
-        result = stats_collection.update_one(
-            {"ad_id": ad_id, "package_name": package_name},
-            {
-                "$inc": {"completed_views_count": 1},
-                "$setOnInsert": {
-                    "clicks_count": 0,
-                    "views_count": 0,
-                    "created_at": now,
-                    "category": category
-                },
-                "$set": {
-                    "ad_name": ad_name
-                }
-            },
-            upsert=True
-        )
-
-        return jsonify({
-            "message": "Completed view recorded successfully",
-            "upserted": result.upserted_id is not None
-        }), 200
-
-    except Exception as e:
-        print("⚠️ ERROR:", str(e))
-        return jsonify({"error": str(e)}), 500
+    """Record a completed view for a video ad in a specific app"""
+    return _bump("completed_views_count", ad_id, None, "Completed view")
 
 
 # 4. Get summarized ad stats
 @ad_sdk_blueprint.route('/ad_sdk/AdClickStats/summary', methods=['GET'])
+@cache.cached(timeout=SUMMARY_CACHE_TIMEOUT, key_prefix=_summary_cache_key, response_filter=_cache_ok)
 def get_ad_click_summary():
-    db = MongoConnectionManager.get_db()
+    db = MongoConnectionManager.get_read_db()
     if db is None:
-        return jsonify({"error": "Database connection error"}), 500
+        return _db_error()
 
     stats = db["AdClickStats"].aggregate([
         {
@@ -538,8 +661,10 @@ def get_ad_click_summary():
                 "total_views": {"$sum": "$views_count"},
                 "total_completed_views": {"$sum": "$completed_views_count"}
             }
-        }
-    ])
+        },
+        # The totals are the whole response - no _id to strip afterwards
+        {"$project": {"_id": 0}}
+    ], maxTimeMS=MONGO_MAX_TIME_MS)
 
     result = next(stats, None)
     if not result:
@@ -549,8 +674,4 @@ def get_ad_click_summary():
             "total_completed_views": 0
         }), 200
 
-    return jsonify({
-        "total_clicks": result["total_clicks"],
-        "total_views": result["total_views"],
-        "total_completed_views": result["total_completed_views"]
-    }), 200
+    return jsonify(result), 200
@@ -0,0 +1,15 @@
+import multiprocessing
+import os
+
+# Gunicorn settings for running the API outside Vercel:
+#   gunicorn -c gunicorn.conf.py app:app
+# Every view waits on MongoDB, so workers are gevent based: gunicorn monkey-patches
+# the process before loading the app, making PyMongo's sockets cooperative and letting
+# one worker keep many Mongo round-trips in flight. Set GUNICORN_WORKER_CLASS=gthread
+# to fall back to a thread pool per worker.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8088)}"
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
@@ -0,0 +1,52 @@
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+import datetime
+import json
+
+# orjson is CPython only - PyPy falls back to the stdlib json (its JIT covers the gap)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_default(value):
+    # Same wire format as Flask's default provider: HTTP dates for datetimes,
+    # strings for ObjectId and friends
+    if isinstance(value, datetime.datetime):
+        return http_date(value)
+    return str(value)
+
+
+def dumps_bytes(payload):
+    """
+    Serialize Mongo documents with orjson (stdlib json on PyPy), compact and with sorted keys.
+    :param payload: document or list of documents
+    :rtype: bytes or str
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            payload,
+            default=json_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS
+        )
+    return json.dumps(payload, default=json_default, sort_keys=True, separators=(',', ':'))
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson, so jsonify() and request.get_json() skip the
+    stdlib encoder. The output matches DefaultJSONProvider's compact form, except that
+    non-ASCII text is sent as UTF-8 instead of \\u escapes.
+    """
+
+    def dumps(self, obj, **kwargs):
+        # Pretty-printed output (debug mode) is left to the stdlib encoder
+        if orjson is None or kwargs.get("indent"):
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
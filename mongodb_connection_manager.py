@@ -1,7 +1,9 @@
+from bson import ObjectId
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, ReadPreference
 from pymongo.server_api import ServerApi
 import os
+import threading
 
 # Load environment variables 
 load_dotenv() 
@@ -13,8 +15,59 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 
 MONGO_URI = f"mongodb+srv://{DB_USERNAME}:{DB_PASSWORD}@{DB_CONNECTION_STRING}/{DB_NAME}?retryWrites=true&w=majority"
 
+# Connection pool settings - one pool per process, shared by all requests
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "5000"))
+# Fail fast on an unreachable cluster instead of the 20-30 s driver defaults
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "3000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+# Close pooled connections idle for longer than this, down to MONGO_MIN_POOL_SIZE
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+# Wire compression, in order of preference - the server picks the first one it supports
+# (zstd comes with the pymongo[zstd] extra, zlib with Python)
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,zlib")
+# Read preference of the GET endpoints (e.g. SECONDARY_PREFERRED to spread them over the replicas).
+# Primary by default: a lagging secondary could refill the response cache with data older than a write
+MONGO_READ_PREFERENCE = getattr(ReadPreference, os.getenv("MONGO_READ_PREFERENCE", "PRIMARY").upper())
+# Server-side time limit of the reads, so a slow member cannot hold a request open
+MONGO_MAX_TIME_MS = int(os.getenv("MONGO_MAX_TIME_MS", "2000"))
+
+# All ads live in one collection, partitioned by their package_name field
+ADS_COLLECTION = "Ads"
+# Compound index serving the active-ads filter (package + location equality, then date range)
+AD_FILTER_INDEX = [("package_name", 1), ("ad_location", 1), ("beginning_date", 1), ("expiration_date", 1)]
+# Index serving the category filter when no location is given (package + category equality, then dates)
+AD_CATEGORY_INDEX = [("package_name", 1), ("category", 1), ("beginning_date", 1), ("expiration_date", 1)]
+# Index serving the not-yet-expired ads of a package
+AD_EXPIRATION_INDEX = [("package_name", 1), ("expiration_date", 1)]
+# Index serving the latest-update lookup behind the ETag of a package
+AD_UPDATED_INDEX = [("package_name", 1), ("updated_at", -1)]
+# One stats document per ad and app - its ad_id prefix also serves the per-ad lookups
+STATS_UNIQUE_INDEX = [("ad_id", 1), ("package_name", 1)]
+
+def ad_key(ad_id):
+    """
+    The stored _id of an ad from the id clients send: an ObjectId for ads created since ids
+    became ObjectIds, the string itself for older ads (UUID strings).
+    :param ad_id: id from the URL or a stats event
+    :rtype: ObjectId or str
+    """
+    if len(ad_id) == 24 and ObjectId.is_valid(ad_id):
+        return ObjectId(ad_id)
+    return ad_id
+
+
 class MongoConnectionManager:
+    __client = None
     __db = None
+    # Same database, read with MONGO_READ_PREFERENCE
+    __read_db = None
+    # Collections whose indexes this process has already ensured
+    __indexed = set()
+    # Serializes the first initialization between request threads
+    __lock = threading.Lock()
 
     @staticmethod
     def initialize_db():
@@ -23,34 +76,134 @@ class MongoConnectionManager:
         :return: MongoDB connection 
         :rtype: Database
         """
-        if MongoConnectionManager.__db is None:
-            try:
-                # Create a new client and connect to the server
-                client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
+        if MongoConnectionManager.__db is not None:
+            return MongoConnectionManager.__db
 
-                # Send a ping to confirm a successful connection
-                client.admin.command('ping')
-                print("Pinged your deployment. You successfully connected to MongoDB!")
+        with MongoConnectionManager.__lock:
+            # Another thread may have finished while this one waited
+            if MongoConnectionManager.__db is not None:
+                return MongoConnectionManager.__db
 
-                MongoConnectionManager.__db = client[DB_NAME]
-
-                # Create a unique index on (ad_id, package_name) once
-                MongoConnectionManager.__db['AdClickStats'].create_index(
-                    [("ad_id", 1), ("package_name", 1)], unique=True
+            try:
+                # Create a single pooled client - connect=False defers the first connection
+                client = MongoClient(
+                    MONGO_URI,
+                    server_api=ServerApi('1'),
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    compressors=MONGO_COMPRESSORS,
+                    connect=False
                 )
-
+                db = client[DB_NAME]
             except Exception as e:
                 print(e)
+                return None
+
+            # Keep the client even if the server is not reachable yet: the pool reconnects
+            # on its own, while building a new client per request would open a new pool each time
+            MongoConnectionManager.__client = client
+            MongoConnectionManager.__db = db
+            MongoConnectionManager.__read_db = db.with_options(read_preference=MONGO_READ_PREFERENCE)
+
+            # Health check off the request path - the first request does not wait for the round-trip
+            threading.Thread(target=MongoConnectionManager._ping, args=(client,), name="mongo-ping", daemon=True).start()
 
         return MongoConnectionManager.__db
 
+    @staticmethod
+    def _ping(client):
+        try:
+            # Send a ping to confirm a successful connection
+            client.admin.command('ping')
+            print("Pinged your deployment. You successfully connected to MongoDB!")
+
+        except Exception as e:
+            print(e)
+
+    @staticmethod
+    def _reset_after_fork():
+        # A client must not be shared across fork() - each child builds its own on first use
+        MongoConnectionManager.__client = None
+        MongoConnectionManager.__db = None
+        MongoConnectionManager.__read_db = None
+        MongoConnectionManager.__lock = threading.Lock()
+
+    @staticmethod
+    def ensure_indexes_once(db, collection_name):
+        """
+        Create the indexes of a collection the first time this process writes to it,
+        instead of on every cold start. Indexes persist in the database, so reads need no check.
+        :param db: MongoDB database
+        :param collection_name: ADS_COLLECTION or 'AdClickStats'
+        """
+        if collection_name in MongoConnectionManager.__indexed:
+            return
+        if collection_name == ADS_COLLECTION:
+            MongoConnectionManager.ensure_ad_indexes(db)
+        else:
+            MongoConnectionManager.ensure_stats_indexes(db)
+        MongoConnectionManager.__indexed.add(collection_name)
+
+    @staticmethod
+    def ensure_ad_indexes(db):
+        """
+        Create the indexes of the ads collection (idempotent).
+        :param db: MongoDB database
+        """
+        ads = db[ADS_COLLECTION]
+        ads.create_index(AD_FILTER_INDEX)
+        ads.create_index(AD_CATEGORY_INDEX)
+        ads.create_index(AD_EXPIRATION_INDEX)
+        ads.create_index(AD_UPDATED_INDEX)
+
+    @staticmethod
+    def ensure_stats_indexes(db):
+        """
+        Create the indexes of the AdClickStats collection (idempotent).
+        :param db: MongoDB database
+        """
+        db['AdClickStats'].create_index(STATS_UNIQUE_INDEX, unique=True)
+
     @staticmethod
     def get_db():
         """
         Get the database connection.
+        Once the client exists this is a plain attribute read - no new client or handshake per request.
         :return: MongoDB connection 
         :rtype: Database
         """
         if MongoConnectionManager.__db is None:
             MongoConnectionManager.initialize_db()
-        return MongoConnectionManager.__db
\ No newline at end of file
+        return MongoConnectionManager.__db
+
+    @staticmethod
+    def get_read_db():
+        """
+        Get the database handle of the read-only endpoints, which reads with MONGO_READ_PREFERENCE.
+        Writes, and reads that must see them (e.g. update_ad's date check), keep using get_db().
+        :return: MongoDB connection
+        :rtype: Database
+        """
+        if MongoConnectionManager.__read_db is None:
+            MongoConnectionManager.initialize_db()
+        return MongoConnectionManager.__read_db
+
+    @staticmethod
+    def get_client():
+        """
+        Get the shared, pooled MongoDB client.
+        :return: MongoDB client
+        :rtype: MongoClient
+        """
+        if MongoConnectionManager.__client is None:
+            MongoConnectionManager.initialize_db()
+        return MongoConnectionManager.__client
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=MongoConnectionManager._reset_after_fork)
@@ -0,0 +1,215 @@
+from collections import defaultdict
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from mongodb_connection_manager import MongoConnectionManager, ADS_COLLECTION, ad_key
+import atexit
+import functools
+import os
+import threading
+import time
+
+# Load environment variables
+load_dotenv()
+
+# Buffer click/view events in memory and write them in batches (needs a long-running worker)
+STATS_BATCH_WRITES = os.getenv("STATS_BATCH_WRITES") == "1"
+STATS_FLUSH_INTERVAL_MS = int(os.getenv("STATS_FLUSH_INTERVAL_MS", "50"))
+STATS_FLUSH_MAX_EVENTS = int(os.getenv("STATS_FLUSH_MAX_EVENTS", "1000"))
+
+STATS_COUNTERS = ("clicks_count", "views_count", "completed_views_count")
+
+# Stats placeholders for ads that cannot be found
+UNKNOWN_AD_NAME = "Unknown Ad"
+UNKNOWN_CATEGORY = "Unknown"
+
+# Other workers do not see this worker's evictions - their copies expire after this many seconds
+AD_DETAILS_TTL = 60
+
+
+@functools.lru_cache(maxsize=10000)
+def _ad_details(ad_id, ttl_bucket):
+    # ttl_bucket changes every AD_DETAILS_TTL seconds, which retires the older entries
+    ad_doc = MongoConnectionManager.get_db()[ADS_COLLECTION].find_one({"_id": ad_key(ad_id)}, {"name": 1, "category": 1}) or {}
+    return ad_doc.get("name", UNKNOWN_AD_NAME), ad_doc.get("category", UNKNOWN_CATEGORY)
+
+
+def forget_ad_details():
+    """
+    Drop the memoized ad names / categories of this worker (after an ad update or delete).
+    """
+    _ad_details.cache_clear()
+
+
+def fill_new_stats_details(db, stats_id, ad_id, with_category=True):
+    """
+    Copy the ad's name (and category) into a stats document that was just created.
+    Runs only on the first event of an ad in an app, and the ad lookup is memoized,
+    so the same ad reported by many apps is read once; update_ad keeps the copied name in sync.
+    :param stats_id: _id of the new AdClickStats document
+    """
+    name, category = _ad_details(ad_id, int(time.monotonic() // AD_DETAILS_TTL))
+    details = {"ad_name": name}
+    if with_category:
+        details["category"] = category
+    db["AdClickStats"].update_one({"_id": stats_id}, {"$set": details})
+
+
+def epoch_ms():
+    """
+    Current time in milliseconds since the epoch - the stats timestamps (created_at,
+    last_clicked_at) are stored as int64 to skip building and encoding datetimes on every event.
+    :rtype: int
+    """
+    return time.time_ns() // 1_000_000
+
+
+def stats_upsert(ad_id, package_name, category, inc, now, last_clicked_at=None):
+    """
+    Filter and update of a stats upsert, shared by the direct and the batched writes.
+    The filter is the unique (ad_id, package_name) key alone, so a view reporting another
+    category than the stored one still counts instead of failing with a duplicate key error.
+    :param category: category reported by a view, stored when the upsert inserts - or None
+    :param inc: counter -> increment
+    :param now: epoch_ms() of the write
+    :return: (filter, update)
+    :rtype: tuple
+    """
+    stats_filter = {"ad_id": ad_id, "package_name": package_name}
+    on_insert = {counter: 0 for counter in STATS_COUNTERS if counter not in inc}
+    on_insert.update({
+        "created_at": now,
+        "ad_name": UNKNOWN_AD_NAME,
+        "category": category if category is not None else UNKNOWN_CATEGORY
+    })
+    update = {"$inc": inc, "$setOnInsert": on_insert}
+    if last_clicked_at is not None:
+        update["$set"] = {"last_clicked_at": last_clicked_at}
+    return stats_filter, update
+
+
+class StatsBatcher:
+    """
+    Coalesces stats counter increments in memory and flushes them with one unordered
+    bulk_write every STATS_FLUSH_INTERVAL_MS, or sooner once STATS_FLUSH_MAX_EVENTS are pending.
+    Every pending event of an (ad_id, package_name) - the unique key of the stats documents -
+    is merged into a single upsert, so a new ad's first click and first view cannot race each
+    other into a duplicate key error. A failed write puts its increments back for the next flush.
+    """
+
+    def __init__(self, interval_ms=STATS_FLUSH_INTERVAL_MS, max_events=STATS_FLUSH_MAX_EVENTS):
+        self.interval = interval_ms / 1000
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # (ad_id, package_name, counter) -> pending increment
+        self._pending = defaultdict(int)
+        # (ad_id, package_name) -> category reported by a view, stored if the upsert inserts
+        self._categories = {}
+        # (ad_id, package_name) -> time of the latest click
+        self._last_clicked = {}
+        self._events = 0
+        self._thread = None
+        self._pid = None
+
+    def add(self, ad_id, package_name, counter, category=None, now=None):
+        """
+        Queue one event. category is the one a view reports, or None.
+        :param counter: one of STATS_COUNTERS
+        """
+        with self._lock:
+            self._pending[(ad_id, package_name, counter)] += 1
+            if category is not None:
+                self._categories[(ad_id, package_name)] = category
+            if counter == "clicks_count":
+                self._last_clicked[(ad_id, package_name)] = now or epoch_ms()
+            self._events += 1
+            self._ensure_thread()
+            if self._events >= self.max_events:
+                self._wakeup.set()
+
+    def _ensure_thread(self):
+        # Started lazily so every forked worker runs its own flusher
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="stats-batcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print("⚠️ Stats flush error:", str(e))
+
+    def _drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            categories, self._categories = self._categories, {}
+            last_clicked, self._last_clicked = self._last_clicked, {}
+            self._events = 0
+
+        increments = defaultdict(dict)
+        for (ad_id, package_name, counter), count in pending.items():
+            increments[(ad_id, package_name)][counter] = count
+        return increments, categories, last_clicked
+
+    def _restore(self, increments, categories, last_clicked):
+        # Merge the increments of a failed flush back under the events queued meanwhile
+        with self._lock:
+            for (ad_id, package_name), inc in increments.items():
+                for counter, count in inc.items():
+                    self._pending[(ad_id, package_name, counter)] += count
+            for key, category in categories.items():
+                self._categories.setdefault(key, category)
+            for key, clicked_at in last_clicked.items():
+                self._last_clicked.setdefault(key, clicked_at)
+
+    def flush(self):
+        """
+        Write every pending increment in one bulk_write.
+        :return: number of stats documents written
+        :rtype: int
+        """
+        increments, categories, last_clicked = self._drain()
+        if not increments:
+            return 0
+
+        now = epoch_ms()
+        keys = list(increments)
+        ops = []
+        for key in keys:
+            ad_id, package_name = key
+            stats_filter, update = stats_upsert(
+                ad_id, package_name, categories.get(key), increments[key], now, last_clicked.get(key)
+            )
+            ops.append(UpdateOne(stats_filter, update, upsert=True))
+
+        try:
+            db = MongoConnectionManager.get_db()
+            if db is None:
+                raise RuntimeError("Database connection error")
+            MongoConnectionManager.ensure_indexes_once(db, "AdClickStats")
+            upserted_ids = db["AdClickStats"].bulk_write(ops, ordered=False).upserted_ids
+        except BulkWriteError as e:
+            # Unordered - the other operations were still applied
+            print("⚠️ Stats flush error:", str(e))
+            upserted_ids = {doc["index"]: doc["_id"] for doc in e.details.get("upserted", [])}
+        except Exception:
+            # The write failed as a whole (no server, lost connection...) - retry it on the next flush
+            self._restore(increments, categories, last_clicked)
+            raise
+
+        for index, stats_id in upserted_ids.items():
+            ad_id, package_name = keys[index]
+            fill_new_stats_details(db, stats_id, ad_id, with_category=(ad_id, package_name) not in categories)
+        return len(ops)
+
+
+stats_batcher = StatsBatcher()
+
+if STATS_BATCH_WRITES:
+    # Write what is left in the buffer when the worker shuts down
+    atexit.register(stats_batcher.flush)
@@ -0,0 +1,34 @@
+"""
+Render the Swagger spec of the API to static/openapi.json.
+Production (ENV=production) serves this file instead of running flasgger, so
+rebuild it whenever a spec in contrallers/specs/ changes:
+
+    python tools/build_openapi.py
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask
+from flasgger import Swagger
+from routes import initial_routes
+
+
+if __name__ == "__main__":
+    # Only the routes are needed to render the spec - no database connection
+    app = Flask(__name__)
+    initial_routes(app)
+    swagger = Swagger(app)
+
+    with app.test_request_context():
+        spec = swagger.get_apispecs()
+
+    path = os.path.join(ROOT, "static", "openapi.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(spec, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {path}")
@@ -0,0 +1,22 @@
+"""
+Create the indexes of the ads and stats collections.
+The app creates them on the first write of each process; run this to build them ahead of a deploy:
+
+    python tools/create_ad_indexes.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mongodb_connection_manager import MongoConnectionManager, ADS_COLLECTION
+
+
+if __name__ == "__main__":
+    db = MongoConnectionManager.get_db()
+    if db is None:
+        sys.exit("Database connection error")
+
+    MongoConnectionManager.ensure_ad_indexes(db)
+    MongoConnectionManager.ensure_stats_indexes(db)
+    print(f"Indexed {ADS_COLLECTION} and AdClickStats")
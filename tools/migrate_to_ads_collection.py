@@ -0,0 +1,99 @@
+"""
+One-time migration from one collection per package to the single ads collection.
+Copies every ad of the named package collections into the ads collection (with
+its package_name set), then drops those collections when --drop is given and confirmed:
+
+    python tools/migrate_to_ads_collection.py <package_name> [<package_name> ...] [--drop]
+
+Documents without the ad fields are left where they are, and their collection is kept.
+Safe to re-run: ads already copied are skipped.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo.errors import BulkWriteError
+from mongodb_connection_manager import MongoConnectionManager, ADS_COLLECTION
+
+# Collections that never held per-package ads
+SKIPPED_COLLECTIONS = {ADS_COLLECTION, "AdClickStats"}
+# Fields every legacy ad has - anything else in the collection is not copied
+AD_FIELDS = ("name", "ad_type", "beginning_date", "expiration_date", "ad_location", "ad_link")
+BATCH_SIZE = 1000
+
+
+def _copy_batch(ads, batch):
+    try:
+        ads.insert_many(batch, ordered=False)
+        return len(batch)
+    except BulkWriteError as e:
+        # Duplicate _id errors (code 11000) are ads copied by an earlier run
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        return e.details["nInserted"]
+
+
+def _copy_package(db, ads, name):
+    """
+    Copy the ads of one package collection.
+    :return: (copied, skipped) document counts
+    :rtype: tuple
+    """
+    copied = skipped = 0
+    batch = []
+    for ad in db[name].find():
+        if not all(field in ad for field in AD_FIELDS):
+            skipped += 1
+            continue
+        ad["package_name"] = name
+        batch.append(ad)
+        if len(batch) == BATCH_SIZE:
+            copied += _copy_batch(ads, batch)
+            batch = []
+    if batch:
+        copied += _copy_batch(ads, batch)
+    return copied, skipped
+
+
+def migrate(db, package_names, drop=False):
+    """
+    :param package_names: legacy collections to copy - only these are read or dropped
+    :param drop: drop the fully copied collections, after confirmation
+    """
+    ads = db[ADS_COLLECTION]
+    existing = set(db.list_collection_names())
+    droppable = []
+    for name in package_names:
+        if name in SKIPPED_COLLECTIONS or name.startswith("system.") or name not in existing:
+            print(f"{name}: not a package collection, skipped")
+            continue
+
+        copied, skipped = _copy_package(db, ads, name)
+        print(f"{name}: copied {copied} ads" + (f", skipped {skipped} documents without ad fields" if skipped else ""))
+        if not skipped:
+            droppable.append(name)
+
+    MongoConnectionManager.ensure_ad_indexes(db)
+
+    if drop and droppable:
+        print("Collections to drop:", ", ".join(droppable))
+        if input("Drop them? [y/N] ").strip().lower() != "y":
+            print("Nothing dropped")
+            return
+        for name in droppable:
+            db.drop_collection(name)
+            print(f"{name}: dropped")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    package_names = [arg for arg in args if not arg.startswith("--")]
+    if not package_names:
+        sys.exit(__doc__)
+
+    db = MongoConnectionManager.get_db()
+    if db is None:
+        sys.exit("Database connection error")
+
+    migrate(db, package_names, drop="--drop" in args)